@@ -1,7 +1,9 @@
 import pandas as pd
-import os
+import numpy as np
 import glob
+import importlib.util
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 # --- 1. Setup: Define the list of input files and the output name/format ---
 
@@ -10,23 +12,65 @@ INPUT_FILES = glob.glob('dusitcentralpark_va/dusit*.csv')
 
 OUTPUT_FILE = 'output/dusitcentralpark_com_summary_VAQ4.csv' # Define the output file name
 
+# Only the columns the report needs, with explicit types so pandas skips type inference.
+# Risk is an ordered categorical so it already sorts by priority (Critical > High > Medium > Low).
+COL_DTYPES = {
+    'Name': 'category',
+    'Host': 'category',
+    'Port': 'UInt16',  # TCP/UDP ports fit in 16 bits; nullable so a blank Port still loads
+    'Risk': pd.CategoricalDtype(categories=['Critical', 'High', 'Medium', 'Low'], ordered=True),
+}
+
+# Use pyarrow's multithreaded CSV reader when it is installed, otherwise fall back to the C engine
+CSV_ENGINE = 'pyarrow' if importlib.util.find_spec('pyarrow') else 'c'
+
+# The C engine releases the GIL while parsing, so read several files at once on threads.
+# pyarrow already parses each file on multiple threads, so files are read one at a time.
+READ_WORKERS = 1 if CSV_ENGINE == 'pyarrow' else max(1, min(8, len(INPUT_FILES)))
+
+def read_input_file(file_name):
+    """Reads one input CSV, or returns None if the file is missing."""
+    # glob only returns existing files, so a missing file here means it vanished since the glob
+    try:
+        df_part = pd.read_csv(file_name, usecols=list(COL_DTYPES), dtype=COL_DTYPES, engine=CSV_ENGINE)
+    except FileNotFoundError:
+        print(f"Warning: Input file not found: {file_name}. Skipping.")
+        return None
+    # Optional: Add a column to know which file the data came from
+    df_part['SourceFile'] = file_name
+    return df_part
+
 try:
     # --- 2. Read & Combine: Load all CSV data into a single Pandas DataFrame ---
     all_dfs = []
+    total_rows = 0
+
+    # (Name, Host, Port) instances already kept from earlier files
+    seen_instances = set()
     
     print("Starting data processing...")
     
-    for file_name in INPUT_FILES:
-        # Check if the file exists before attempting to read it
-        if not os.path.exists(file_name):
-            print(f"Warning: Input file not found: {file_name}. Skipping.")
-            continue
-            
-        # Read each individual file
-        df_part = pd.read_csv(file_name)
-        # Optional: Add a column to know which file the data came from
-        df_part['SourceFile'] = file_name
-        all_dfs.append(df_part)
+    # Read each individual file; results come back in INPUT_FILES order, so deduplication
+    # below keeps the same "first file wins" behavior as a sequential read
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        for df_part in executor.map(read_input_file, INPUT_FILES):
+            if df_part is None:
+                continue
+            total_rows += len(df_part)
+
+            # --- NEW LOGIC: DEDUPLICATE INSTANCES ---
+            # Deduplicate rows based on the combination of Name, Host, and Port while reading,
+            # so duplicates never reach the combined DataFrame.
+            # This prevents the same vulnerability on the same port on the same host
+            # from being counted multiple times.
+            # If the 'Port' column is missing, read_csv (usecols) raises a ValueError.
+            keys = zip(df_part['Name'], df_part['Host'], df_part['Port'])
+            is_first = np.fromiter(
+                (k not in seen_instances and not seen_instances.add(k) for k in keys),
+                dtype=bool, count=len(df_part)
+            )
+            all_dfs.append(df_part[is_first])
+            # --- END DEDUPLICATION LOGIC ---
         
     if not all_dfs:
         print("Error: No input files were successfully read. Exiting.")
@@ -35,29 +79,18 @@ try:
         # Concatenate all DataFrames into one master DataFrame
         df = pd.concat(all_dfs, ignore_index=True)
         
-        print(f"\nSuccessfully combined {len(all_dfs)} input files. Total rows: {len(df)}")
-        
-        # --- NEW LOGIC: DEDUPLICATE INSTANCES ---
-        initial_rows = len(df)
-        
-        # Deduplicate rows based on the combination of Name, Host, and Port.
-        # This prevents the same vulnerability on the same port on the same host
-        # from being counted multiple times.
-        # If 'Port' column is missing, this will raise a KeyError.
-        df = df.drop_duplicates(subset=['Name', 'Host', 'Port'], keep='first')
-        
-        deduplicated_rows = len(df)
-        print(f"Deduplication applied: {initial_rows - deduplicated_rows} duplicate rows removed.")
-        # --- END DEDUPLICATION LOGIC ---
+        print(f"\nSuccessfully combined {len(all_dfs)} input files. Total rows: {total_rows}")
+        print(f"Deduplication applied: {total_rows - len(df)} duplicate rows removed.")
         
         print("\n--- Combined Raw Data (First 5 rows) ---")
         print(df.head())
         
         # --- 3. Query (Filtering & Aggregation) ---
         
-        # Filter rows where the 'Risk' column value is in the target_risks list
-        target_risks = ['Critical', 'High', 'Medium']
-        filtered_df = df[df['Risk'].isin(target_risks)].copy() # Use .copy() to avoid SettingWithCopyWarning
+        # Filter rows where the 'Risk' column value is Critical, High or Medium.
+        # 'Risk' is an ordered categorical, so this compares integer category codes
+        # instead of strings; rows with no (or an unknown) Risk compare False.
+        filtered_df = df[df['Risk'] <= 'Medium'] # No .copy(): filtered_df is only read, groupby builds new frames
         
         if filtered_df.empty:
             print("\nNo data remaining after filtering. Exiting.")
@@ -68,33 +101,24 @@ try:
 
         # 3a. Generate the Host Detail Data (The specific counts for each host)
         # Group by Name, Risk, and Host, and count how many times it appears (Per_Host_Count)
-        detail_df = filtered_df.groupby(['Name', 'Risk', 'Host']).size().reset_index(name='Per_Host_Count')
+        detail_df = filtered_df.groupby(['Name', 'Risk', 'Host'], observed=True, sort=False).size().reset_index(name='Per_Host_Count')
         
-        # 3b. Generate the Summary Data (The overall counts)
-        # Group by Name and Risk, and get the Total Count and Unique Host Count
-        summary_df = filtered_df.groupby(['Name', 'Risk']).agg(
-            Total_Count=('Risk', 'size'),
-        ).reset_index()
-
-        # 3c. Merge the two DataFrames
-        # Join the detailed counts with the overall summary counts on Name and Risk.
-        report_df = pd.merge(detail_df, summary_df, on=['Name', 'Risk'], how='left')
+        # 3b. Derive the Summary Data (The overall counts) from the detail counts
+        # Summing Per_Host_Count within each Name and Risk gives the Total Count for every host row,
+        # so no second groupby over filtered_df or merge is needed.
+        detail_df['Total_Count'] = detail_df.groupby(['Name', 'Risk'], observed=True, sort=False)['Per_Host_Count'].transform('sum')
+        report_df = detail_df
 
 
         # --- SORTING BY RISK PRIORITY (CRITICAL > HIGH > MEDIUM) ---
         
-        # 1. Define the custom risk order for sorting
-        risk_order = ['Critical', 'High', 'Medium']
-
-        # 2. Convert the 'Risk' column to a categorical type with the specified order
-        risk_cat = pd.CategoricalDtype(categories=risk_order, ordered=True)
-        report_df['Risk'] = report_df['Risk'].astype(risk_cat)
-
-        # 3. Sort the DataFrame: first by 'Risk', then by 'Total_Count' (descending), 
-        #    and finally by 'Name' for stable grouping.
+        # 'Risk' is read as an ordered categorical (see COL_DTYPES), so sorting on it
+        # follows the risk priority rather than alphabetical order.
+        # Sort the DataFrame: first by 'Risk', then by 'Total_Count' (descending), 
+        #    then by 'Name' for stable grouping, and finally by 'Host' within each group.
         report_df = report_df.sort_values(
-            by=['Risk', 'Total_Count', 'Name'], 
-            ascending=[True, False, True]
+            by=['Risk', 'Total_Count', 'Name', 'Host'], 
+            ascending=[True, False, True, True]
         )
 
         # Reorder columns to match the desired output structure
@@ -1,31 +1,37 @@
 import pandas as pd
+import numpy as np
 import glob
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill, Font, Alignment
 import os
-
-def standardize(val):
-    if val is None or pd.isna(val):
-        return ""
-    return str(val).strip().upper()
+import sys
+from itertools import compress
+
+# Styles are immutable in openpyxl, so build each one once and share it.
+# Colors are written in full 8-character ARGB form so every color is stored the same way and
+# round-trips unchanged; Excel ignores the alpha on solid fills, so this does not change how they look.
+HEADER_FILL = PatternFill(start_color='FF0070C0', end_color='FF0070C0', fill_type='solid')
+NEW_ISSUE_FILL = PatternFill(start_color='FFB02418', end_color='FFB02418', fill_type='solid')
+EXISTING_FILL = PatternFill(start_color='FF4FAD5B', end_color='FF4FAD5B', fill_type='solid')
+BOLD_WHITE_FONT = Font(color='FFFFFFFF', bold=True)
+CENTER_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+
+def standardize_column(col):
+    """Returns col as stripped, upper-cased strings, with blanks (None/NaN) as ""."""
+    return col.fillna('').astype(str).str.strip().str.upper()
 
 def apply_header_style(cell):
     """Applies Blue background, White Bold text, and Center alignment."""
-    cell.fill = PatternFill(start_color='0070C0', end_color='0070C0', fill_type='solid')
-    cell.font = Font(color='FFFFFF', bold=True)
-    cell.alignment = Alignment(horizontal='center', vertical='center')
-
-def safe_write(ws, row, col, value, style_func=None):
-    """Safely write to cells, handling merged ranges if they exist."""
-    cell = ws.cell(row=row, column=col)
-    if isinstance(cell, openpyxl.cell.cell.MergedCell):
-        for merged_range in ws.merged_cells.ranges:
-            if cell.coordinate in merged_range:
-                cell = ws.cell(row=merged_range.min_row, column=merged_range.min_col)
-                break
-    cell.value = value
-    if style_func: 
-        style_func(cell)
+    cell.fill = HEADER_FILL
+    cell.font = BOLD_WHITE_FONT
+    cell.alignment = CENTER_ALIGNMENT
+
+def header_cell(ws, value):
+    """Builds a header-styled cell that can be passed to ws.append()."""
+    cell = WriteOnlyCell(ws, value=value)
+    apply_header_style(cell)
+    return cell
 
 def process_new_issues_with_risk():
     output_folder = "output"
@@ -44,155 +50,167 @@ def process_new_issues_with_risk():
     match_cols = ['Plugin ID', 'Host', 'Protocol', 'Port']
 
     # --- STEP 1: LOAD Q3 INTO LOOKUP SET ---
-    q3_dict = pd.read_excel(q3_path, sheet_name=None)
-    df_q3_all = pd.concat(q3_dict.values(), ignore_index=True)
-    
+    # Stream Q3 in read-only mode; only the match columns of each row are needed
+    wb_q3 = openpyxl.load_workbook(q3_path, read_only=True, data_only=True)
     q3_existing_issues = set()
-    for _, row in df_q3_all.iterrows():
-        fingerprint = tuple(standardize(row.get(c)) for c in match_cols)
-        if fingerprint[0]:
-            q3_existing_issues.add(fingerprint)
+    for ws_q3 in wb_q3.worksheets:
+        # Don't trust the stored <dimension>: a stale one would cut rows/columns from the stream
+        ws_q3.reset_dimensions()
+        rows = ws_q3.iter_rows(values_only=True)
+        header = [str(c).strip() if c else '' for c in next(rows, ())]
+        if 'Plugin ID' not in header:
+            continue
+        # A match column missing from this sheet counts as blank, like an empty cell
+        idx = [header.index(c) if c in header else None for c in match_cols]
+
+        for row in rows:
+            vals = (row[i] if i is not None and i < len(row) else None for i in idx)
+            # Interned so repeated hosts/protocols/ports share one string object (and its cached hash)
+            fingerprint = tuple(sys.intern('' if v is None else str(v).strip().upper()) for v in vals)
+            if fingerprint[0]:
+                q3_existing_issues.add(fingerprint)
+    wb_q3.close()
 
     # --- STEP 2: PROCESS Q4 BASE WORKBOOK ---
-    wb = openpyxl.load_workbook(q4_path)
-    new_issue_fill = PatternFill(start_color='B02418', end_color='B02418', fill_type='solid')
-    existing_fill = PatternFill(start_color='4FAD5B', end_color='4FAD5B', fill_type='solid')
+    # Q4 is only read; results are kept in memory and streamed to a new workbook in STEP 4
+    wb_q4 = openpyxl.load_workbook(q4_path, read_only=True)
 
     summary_data = {}
+    # (sheet name, rows, Status column position, is_new flags) for every output sheet, in Q4 order
+    sheets_out = []
 
-    for sheet_name in wb.sheetnames:
-        ws = wb[sheet_name]
-        headers = [str(cell.value).strip() if cell.value else f"BlankCol_{i}" for i, cell in enumerate(ws[1])]
+    for ws in wb_q4.worksheets:
+        sheet_name = ws.title
+        if sheet_name == "RecurrenceSummary":
+            continue
+        # Don't trust the stored <dimension>: a stale one would cut rows/columns from the stream.
+        # Without it each row only runs to its own last cell, so pad them all to the widest one
+        ws.reset_dimensions()
+        rows = list(ws.iter_rows(values_only=True))
+        width = max(map(len, rows), default=0)
+        rows = iter([row_vals + (None,) * (width - len(row_vals)) for row_vals in rows])
+        header_vals = next(rows, ())
+        headers = [str(v).strip() if v else f"BlankCol_{i}" for i, v in enumerate(header_vals)]
         
         try:
             # Explicitly mapping the Risk column from your input
             col_map = {col: headers.index(col) + 1 for col in match_cols + ['Name', 'Risk']}
         except ValueError as e:
+            # Sheets without these columns are copied across unchanged
+            sheets_out.append((sheet_name, [header_vals] + list(rows), None, None))
             continue
 
-        seen_in_q4 = set()
-        rows_to_delete = []
-
-        # Deduplicate Q4 internally
-        for row_idx in range(2, ws.max_row + 1):
-            f_q4 = tuple(standardize(ws.cell(row=row_idx, column=col_map[c]).value) for c in match_cols)
-            if f_q4 in seen_in_q4 or ws.cell(row=row_idx, column=col_map['Plugin ID']).value is None:
-                rows_to_delete.append(row_idx)
-            else:
-                seen_in_q4.add(f_q4)
-
-        for row_idx in reversed(rows_to_delete):
-            ws.delete_rows(row_idx)
-
-        # Status Comparison
-        status_col_idx = col_map['Name'] + 1
-        ws.insert_cols(status_col_idx)
-        ws.cell(row=1, column=status_col_idx).value = "Status"
-
-        # Dictionary to hold Risk counts for New vs Existing
-        counts = {
-            'new': {'TOTAL': 0, 'CRITICAL': 0, 'HIGH': 0, 'MEDIUM': 0, 'LOW': 0},
-            'existing': {'TOTAL': 0, 'CRITICAL': 0, 'HIGH': 0, 'MEDIUM': 0, 'LOW': 0}
-        }
-
-        for row_idx in range(2, ws.max_row + 1):
-            check_key = tuple(standardize(ws.cell(row=row_idx, column=col_map[c]).value) for c in match_cols)
-            risk_val = standardize(ws.cell(row=row_idx, column=col_map['Risk']).value)
-            status_cell = ws.cell(row=row_idx, column=status_col_idx)
-            
-            # Logic: If in Q4 but NOT in Q3 -> New Issue
-            category = 'new' if check_key not in q3_existing_issues else 'existing'
-            status_cell.value = "New Issue" if category == 'new' else "Existing"
-            status_cell.fill = new_issue_fill if category == 'new' else existing_fill
-            
-            counts[category]['TOTAL'] += 1
-            if risk_val in counts[category]:
-                counts[category][risk_val] += 1
-        
+        # 0-based positions into the tuples yielded by iter_rows(values_only=True)
+        idx = {col: i - 1 for col, i in col_map.items()}
+
+        # Rows without a Plugin ID (e.g. trailing empty rows) are dropped before anything else
+        data_rows = [row_vals for row_vals in rows if row_vals[idx['Plugin ID']] is not None]
+
+        # Standardize each needed column once up front rather than cell by cell.
+        # dtype=object keeps the cell types openpyxl returned; otherwise a blank cell turns an
+        # int column into floats and e.g. Port 443 standardizes to '443.0', which never matches Q3
+        df_q4 = pd.DataFrame(data_rows, columns=range(len(headers)), dtype=object)
+        std = {c: standardize_column(df_q4[idx[c]]).to_numpy() for c in match_cols + ['Risk']}
+
+        # Deduplicate Q4 internally: keep the first row of each fingerprint
+        keep = ~pd.DataFrame({c: std[c] for c in match_cols}).duplicated().to_numpy()
+        kept_rows = list(compress(data_rows, keep))
+
+        # Classify every row at once: If in Q4 but NOT in Q3 -> New Issue
+        q4_cols = [std[c][keep] for c in match_cols]
+        in_q3 = np.fromiter((fp in q3_existing_issues for fp in zip(*q4_cols)), dtype=bool, count=len(kept_rows))
+        status = pd.Series(np.where(in_q3, 'existing', 'new'))
+        risk = pd.Series(std['Risk'][keep])
+
+        # Risk counts for New vs Existing
+        tally = pd.DataFrame({'Status': status, 'Risk': risk}).groupby(['Status', 'Risk']).size().unstack(fill_value=0)
+        counts = {}
+        for category in ('new', 'existing'):
+            row = tally.loc[category] if category in tally.index else pd.Series(dtype=int)
+            counts[category] = {'TOTAL': int(row.sum())}
+            for r in ('CRITICAL', 'HIGH', 'MEDIUM', 'LOW'):
+                counts[category][r] = int(row.get(r, 0))
+
+        # Status column goes right after Name
+        sheets_out.append((sheet_name, [header_vals] + kept_rows, col_map['Name'], (status == 'new').to_numpy()))
         summary_data[sheet_name] = counts
 
+    wb_q4.close()
+
     # --- STEP 3: CREATE RecurrenceSummary TAB ---
-    if "RecurrenceSummary" in wb.sheetnames:
-        del wb["RecurrenceSummary"]
-    ws_sum = wb.create_sheet("RecurrenceSummary", 0)
+    # Write-only workbook: rows are streamed to disk as they are appended, so sheets are
+    # written in their final order and column widths are set before any rows
+    wb = openpyxl.Workbook(write_only=True)
+    ws_sum = wb.create_sheet("RecurrenceSummary")
+
+    # Formatting
+    ws_sum.column_dimensions['B'].width = 35
+    for col in ['C', 'D', 'E', 'F', 'G']:
+        ws_sum.column_dimensions[col].width = 15
 
     risks = ['CRITICAL', 'HIGH', 'MEDIUM', 'LOW']
     g_total = {'new': 0, 'ext': 0, 'new_r': [0]*4, 'ext_r': [0]*4}
 
+    # Every table row is appended whole, starting from column B (the leading None keeps column A empty)
+    ws_sum.append([])
+
     # --- TABLE 1: NEW VS EXISTING SCOPE ---
-    row_ptr = 2
-    safe_write(ws_sum, row_ptr, 2, "New Vulnerability Issue Summary", apply_header_style)
-    row_ptr += 1
-    safe_write(ws_sum, row_ptr, 2, "Domain", apply_header_style)
-    safe_write(ws_sum, row_ptr, 3, "New Issue", apply_header_style)
-    safe_write(ws_sum, row_ptr, 4, "Existing Issue", apply_header_style)
-    safe_write(ws_sum, row_ptr, 5, "Total Issue", apply_header_style)
-    
-    row_ptr += 1
+    ws_sum.append([None, header_cell(ws_sum, "New Vulnerability Issue Summary")])
+    ws_sum.append([None] + [header_cell(ws_sum, h) for h in ["Domain", "New Issue", "Existing Issue", "Total Issue"]])
+
     for domain, data in summary_data.items():
-        safe_write(ws_sum, row_ptr, 2, domain)
-        safe_write(ws_sum, row_ptr, 3, data['new']['TOTAL'] or "-")
-        safe_write(ws_sum, row_ptr, 4, data['existing']['TOTAL'] or "-")
-        safe_write(ws_sum, row_ptr, 5, (data['new']['TOTAL'] + data['existing']['TOTAL']) or "-")
-        
+        ws_sum.append([None, domain, data['new']['TOTAL'] or "-", data['existing']['TOTAL'] or "-",
+                       (data['new']['TOTAL'] + data['existing']['TOTAL']) or "-"])
+
         g_total['new'] += data['new']['TOTAL']
         g_total['ext'] += data['existing']['TOTAL']
         for i, r in enumerate(risks):
             g_total['new_r'][i] += data['new'][r]
             g_total['ext_r'][i] += data['existing'][r]
-        row_ptr += 1
 
     # Total Table 1
-    safe_write(ws_sum, row_ptr, 2, "Total", apply_header_style)
-    for col, val in enumerate([g_total['new'], g_total['ext'], (g_total['new'] + g_total['ext'])], 3):
-        safe_write(ws_sum, row_ptr, col, val or "-", apply_header_style)
+    ws_sum.append([None] + [header_cell(ws_sum, val or "-") for val in
+                            ["Total", g_total['new'], g_total['ext'], (g_total['new'] + g_total['ext'])]])
 
     # --- TABLE 2: NEW ISSUES RISK MAPPING (3 row gap) ---
-    row_ptr += 4
-    safe_write(ws_sum, row_ptr, 2, "[temp] new issues risk summary", apply_header_style)
-    row_ptr += 1
-    safe_write(ws_sum, row_ptr, 2, "Domain", apply_header_style)
-    for i, r in enumerate(risks + ['Total']):
-        safe_write(ws_sum, row_ptr, 3+i, r, apply_header_style)
-    
-    row_ptr += 1
+    for _ in range(3): ws_sum.append([])
+    ws_sum.append([None, header_cell(ws_sum, "[temp] new issues risk summary")])
+    ws_sum.append([None] + [header_cell(ws_sum, h) for h in ["Domain"] + risks + ['Total']])
+
     for domain, data in summary_data.items():
-        safe_write(ws_sum, row_ptr, 2, domain)
-        for i, r in enumerate(risks):
-            safe_write(ws_sum, row_ptr, 3+i, data['new'][r] or "-")
-        safe_write(ws_sum, row_ptr, 7, data['new']['TOTAL'] or "-")
-        row_ptr += 1
-    
+        ws_sum.append([None, domain] + [data['new'][r] or "-" for r in risks] + [data['new']['TOTAL'] or "-"])
+
     # Total Table 2
-    safe_write(ws_sum, row_ptr, 2, "Total", apply_header_style)
-    for i in range(4): safe_write(ws_sum, row_ptr, 3+i, g_total['new_r'][i] or "-", apply_header_style)
-    safe_write(ws_sum, row_ptr, 7, g_total['new'] or "-", apply_header_style)
+    ws_sum.append([None] + [header_cell(ws_sum, val or "-") for val in ["Total"] + g_total['new_r'] + [g_total['new']]])
 
     # --- TABLE 3: EXISTING ISSUES RISK MAPPING (3 row gap) ---
-    row_ptr += 4
-    safe_write(ws_sum, row_ptr, 2, "[temp] existing issues risk summary", apply_header_style)
-    row_ptr += 1
-    safe_write(ws_sum, row_ptr, 2, "Domain", apply_header_style)
-    for i, r in enumerate(risks + ['Total']):
-        safe_write(ws_sum, row_ptr, 3+i, r, apply_header_style)
-    
-    row_ptr += 1
+    for _ in range(3): ws_sum.append([])
+    ws_sum.append([None, header_cell(ws_sum, "[temp] existing issues risk summary")])
+    ws_sum.append([None] + [header_cell(ws_sum, h) for h in ["Domain"] + risks + ['Total']])
+
     for domain, data in summary_data.items():
-        safe_write(ws_sum, row_ptr, 2, domain)
-        for i, r in enumerate(risks):
-            safe_write(ws_sum, row_ptr, 3+i, data['existing'][r] or "-")
-        safe_write(ws_sum, row_ptr, 7, data['existing']['TOTAL'] or "-")
-        row_ptr += 1
+        ws_sum.append([None, domain] + [data['existing'][r] or "-" for r in risks] + [data['existing']['TOTAL'] or "-"])
 
     # Total Table 3
-    safe_write(ws_sum, row_ptr, 2, "Total", apply_header_style)
-    for i in range(4): safe_write(ws_sum, row_ptr, 3+i, g_total['ext_r'][i] or "-", apply_header_style)
-    safe_write(ws_sum, row_ptr, 7, g_total['ext'] or "-", apply_header_style)
+    ws_sum.append([None] + [header_cell(ws_sum, val or "-") for val in ["Total"] + g_total['ext_r'] + [g_total['ext']]])
+
+    # --- STEP 4: WRITE Q4 SHEETS WITH STATUS ---
+    for sheet_name, rows, status_pos, is_new in sheets_out:
+        ws = wb.create_sheet(sheet_name)
+        if status_pos is None:
+            for row_vals in rows:
+                ws.append(row_vals)
+            continue
 
-    # Formatting
-    ws_sum.column_dimensions['B'].width = 35
-    for col in ['C', 'D', 'E', 'F', 'G']:
-        ws_sum.column_dimensions[col].width = 15
+        # One styled cell per status, re-used for every row (each row is written out on append)
+        new_cell = WriteOnlyCell(ws, value="New Issue")
+        new_cell.fill = NEW_ISSUE_FILL
+        existing_cell = WriteOnlyCell(ws, value="Existing")
+        existing_cell.fill = EXISTING_FILL
+
+        ws.append(rows[0][:status_pos] + ("Status",) + rows[0][status_pos:])
+        for row_vals, new in zip(rows[1:], is_new):
+            ws.append(row_vals[:status_pos] + (new_cell if new else existing_cell,) + row_vals[status_pos:])
 
     wb.save(os.path.join(output_folder, "VA_New_Issues_Final.xlsx"))
     print("\n--- Success! New Issue Summary with Risk Mapping Created. ---")